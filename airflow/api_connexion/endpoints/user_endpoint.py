@@ -22,7 +22,6 @@ from connexion import NoContent
 from flask import request
 from marshmallow import ValidationError
 from sqlalchemy import asc, desc, func, select
-from werkzeug.security import generate_password_hash
 
 from airflow.api_connexion import security
 from airflow.api_connexion.exceptions import AlreadyExists, BadRequest, NotFound, Unknown
@@ -183,7 +182,7 @@ def patch_user(*, username: str, update_mask: UpdateMask = None) -> APIResponse:
         roles_to_update = None  # Don't change existing value.
 
     if "password" in data:
-        user.password = generate_password_hash(data.pop("password"))
+        user.password = security_manager.hash_password(data.pop("password"))
     if roles_to_update is not None:
         user.roles = roles_to_update
     for key, value in data.items():
@@ -204,6 +203,7 @@ def delete_user(*, username: str) -> APIResponse:
         raise NotFound(title="User not found", detail=detail)
 
     user.roles = []  # Clear foreign keys on this user first.
+    security_manager.invalidate_user_cache(user.id)
     security_manager.get_session.delete(user)
     security_manager.get_session.commit()
 
@@ -18,19 +18,24 @@
 from __future__ import annotations
 
 import logging
+import time
 import uuid
+from typing import Any
 
 from flask_appbuilder import const
 from flask_appbuilder.models.sqla import Base
 from sqlalchemy import func, inspect
 from sqlalchemy.exc import MultipleResultsFound
-from werkzeug.security import generate_password_hash
+from sqlalchemy.orm import make_transient_to_detached
 
 from airflow import AirflowException
 from airflow.auth.managers.fab.models import Action, Permission, Resource, Role
 
 log = logging.getLogger(__name__)
 
+# Maximum number of users kept in the user cache of each process
+USER_CACHE_MAXSIZE = 10_000
+
 
 class FabAirflowSecurityManagerOverrideDb:
     """
@@ -53,6 +58,9 @@ class FabAirflowSecurityManagerOverrideDb:
         super().__init__(**kwargs)
 
         self.appbuilder = kwargs["appbuilder"]
+        # Process-local cache of the column values of users loaded on every authenticated request:
+        # {user_id: (expires_at, ((column, value), ...))}, ordered by expiry
+        self._user_cache: dict[int, tuple[float, tuple[tuple[str, Any], ...]]] = {}
 
     @property
     def get_session(self):
@@ -184,7 +192,7 @@ class FabAirflowSecurityManagerOverrideDb:
             if hashed_password:
                 user.password = hashed_password
             else:
-                user.password = generate_password_hash(password)
+                user.password = self.hash_password(password)
             self.get_session.add(user)
             self.get_session.commit()
             log.info(const.LOGMSG_INF_SEC_ADD_USER.format(username))
@@ -196,11 +204,73 @@ class FabAirflowSecurityManagerOverrideDb:
 
     def load_user(self, user_id):
         """Load user by ID."""
-        return self.get_user_by_id(int(user_id))
+        return self.get_cached_user_by_id(int(user_id))
 
     def get_user_by_id(self, pk):
         return self.get_session.get(self.user_model, pk)
 
+    def get_cached_user_by_id(self, pk: int):
+        """
+        Get a user by ID, avoiding the database query if the user was loaded recently.
+
+        Users are kept for ``AUTH_USER_CACHE_TTL`` seconds; the cache is disabled by default (0). Only the
+        column values of the users are cached, their roles and permissions are still loaded when accessed.
+        The cache is local to the process, so changes made by other processes are only seen after the TTL
+        expires.
+
+        :param pk: the user id
+        """
+        ttl = self.auth_user_cache_ttl
+        if not ttl:
+            return self.get_user_by_id(pk)
+        now = time.monotonic()
+        cached = self._user_cache.get(pk)
+        if cached and cached[0] > now:
+            # Rebuild the user from its cached values and attach it to the current session without querying
+            # the database, so that no instance is shared between requests
+            user = self.user_model(**dict(cached[1]))
+            make_transient_to_detached(user)
+            return self.get_session.merge(user, load=False)
+        user = self.get_user_by_id(pk)
+        # Re-insert the user even if it is cached already, to keep the entries ordered by expiry
+        self._user_cache.pop(pk, None)
+        if user:
+            self._evict_users_from_cache(now)
+            values = tuple((attr.key, getattr(user, attr.key)) for attr in inspect(user).mapper.column_attrs)
+            self._user_cache[pk] = (now + ttl, values)
+        return user
+
+    def _evict_users_from_cache(self, now: float) -> None:
+        """Remove the expired users from the user cache, and the oldest ones if it is still full."""
+        user_cache = self._user_cache
+        while user_cache:
+            pk, (expires_at, _) = next(iter(user_cache.items()))
+            if expires_at > now and len(user_cache) < USER_CACHE_MAXSIZE:
+                break
+            del user_cache[pk]
+
+    def invalidate_user_cache(self, pk: int) -> None:
+        """
+        Remove a user from the user cache.
+
+        :param pk: the user id
+        """
+        self._user_cache.pop(pk, None)
+
+    def hash_password(self, password: str) -> str:
+        """
+        Hash a password with the method configured in ``FAB_PASSWORD_HASH_METHOD``.
+
+        The default method of Werkzeug is used if no method is configured.
+
+        :param password: the clear text password to hash
+        """
+        from werkzeug.security import generate_password_hash
+
+        if self.password_hash_method:
+            return generate_password_hash(password, method=self.password_hash_method)
+        return generate_password_hash(password)
+
     def count_users(self):
         """Return the number of users in the database."""
         return self.get_session.query(func.count(self.user_model.id)).scalar()
@@ -219,7 +289,7 @@ class FabAirflowSecurityManagerOverrideDb:
         if hashed_password:
             register_user.password = hashed_password
         else:
-            register_user.password = generate_password_hash(password)
+            register_user.password = self.hash_password(password)
         register_user.registration_hash = str(uuid.uuid1())
         try:
             self.get_session.add(register_user)
@@ -264,6 +334,7 @@ class FabAirflowSecurityManagerOverrideDb:
         )
 
     def update_user(self, user):
+        self.invalidate_user_cache(user.id)
         try:
             self.get_session.merge(user)
             self.get_session.commit()
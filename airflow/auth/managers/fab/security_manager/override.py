@@ -22,32 +22,51 @@ import warnings
 from functools import cached_property
 
 from flask import flash, g
-from flask_appbuilder import const
 from flask_appbuilder.const import AUTH_DB, AUTH_LDAP, AUTH_OAUTH, AUTH_OID, AUTH_REMOTE_USER
 from flask_appbuilder.models.sqla.interface import SQLAInterface
 from flask_babel import lazy_gettext
-from flask_jwt_extended import JWTManager
 from flask_login import LoginManager
-from itsdangerous import want_bytes
 from markupsafe import Markup
-from werkzeug.security import generate_password_hash
+from sqlalchemy import delete
 
 from airflow.auth.managers.fab.models import Action, Permission, RegisterUser, Resource, Role, User
 from airflow.auth.managers.fab.models.anonymous_user import AnonymousUser
 from airflow.auth.managers.fab.security_manager.modules.db import FabAirflowSecurityManagerOverrideDb
 from airflow.auth.managers.fab.security_manager.modules.oauth import FabAirflowSecurityManagerOverrideOauth
+from airflow.utils import timezone
+from airflow.utils.helpers import chunks
 from airflow.www.session import AirflowDatabaseSessionInterface
 
 log = logging.getLogger(__name__)
 
-# This is the limit of DB user sessions that we consider as "healthy". If you have more sessions that this
-# number then we will refuse to delete sessions that have expired and old user sessions when resetting
-# user's password, and raise a warning in the UI instead. Usually when you have that many sessions, it means
-# that there is something wrong with your deployment - for example you have an automated API call that
-# continuously creates new sessions. Such setup should be fixed by reusing sessions or by periodically
-# purging the old sessions by using `airflow db clean` command.
+# This is the limit of DB user sessions that we consider as "healthy". If you have more sessions with a NULL
+# ``user_id`` (saved by webservers not filling that column yet) than this number then we will refuse to
+# delete those of them that belong to the user when resetting user's password, and raise a warning in the UI
+# instead. Usually when you have that many sessions, it means that there is something wrong with your
+# deployment - for example you have an automated API call that continuously creates new sessions. Such setup
+# should be fixed by reusing sessions or by periodically purging the old sessions by using `airflow db clean`
+# command.
 MAX_NUM_DATABASE_USER_SESSIONS = 50000
 
+# Warnings shown when resetting the password of a user; Markup.format escapes the substituted values.
+TOO_MANY_SESSIONS_WARNING = Markup(
+    "Some of the old sessions for user {username} have <b>NOT</b> been deleted!<br>"
+    "You have a lot ({num_sessions}) of user sessions in the 'SESSIONS' table in your database.<br> "
+    "This indicates that this deployment might have an automated API calls that create "
+    "and not reuse sessions.<br>You should consider reusing sessions or cleaning them "
+    "periodically using db clean.<br>"
+    "Make sure to reset password for the user again after cleaning the session table "
+    "to remove old sessions of the user."
+)
+SECURECOOKIE_SESSIONS_WARNING = Markup(
+    "Since you are using `securecookie` session backend mechanism, we cannot prevent "
+    "some old sessions for user {username} to be reused.<br> If you want to make sure "
+    "that the user is logged out from all sessions, you should consider using "
+    "`database` session backend mechanism.<br> You can also change the 'secret_key` "
+    "webserver configuration for all your webserver instances and restart the webserver. "
+    "This however will logout all users from all sessions."
+)
+
 
 class FabAirflowSecurityManagerOverride(
     FabAirflowSecurityManagerOverrideDb, FabAirflowSecurityManagerOverrideOauth
@@ -99,6 +118,27 @@ class FabAirflowSecurityManagerOverride(
     """ Initialized (remote_app) providers dict {'provider_name', OBJ } """
     oauth_allow_list: dict[str, list] = {}
 
+    """ Names of the view attributes to use for each auth type """
+    _USER_VIEW_BY_AUTH_TYPE = {
+        AUTH_DB: "userdbmodelview",
+        AUTH_LDAP: "userldapmodelview",
+        AUTH_OAUTH: "useroauthmodelview",
+        AUTH_OID: "useroidmodelview",
+        AUTH_REMOTE_USER: "userremoteusermodelview",
+    }
+    _AUTH_VIEW_BY_AUTH_TYPE = {
+        AUTH_DB: "authdbview",
+        AUTH_LDAP: "authldapview",
+        AUTH_OAUTH: "authoauthview",
+        AUTH_OID: "authoidview",
+        AUTH_REMOTE_USER: "authremoteuserview",
+    }
+    _REGISTER_USER_VIEW_BY_AUTH_TYPE = {
+        AUTH_DB: "registeruserdbview",
+        AUTH_OAUTH: "registeruseroauthview",
+        AUTH_OID: "registeruseroidview",
+    }
+
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
 
@@ -131,15 +171,17 @@ class FabAirflowSecurityManagerOverride(
         self._init_auth()
         self._init_data_model()
 
-        self._builtin_roles: dict = self.create_builtin_roles()
+        self._builtin_roles: dict[str, frozenset[tuple[str, str]]] = self.create_builtin_roles()
 
         self.create_db()
 
         # Setup Flask login
         self.lm = self.create_login_manager()
 
-        # Setup Flask-Jwt-Extended
-        self.create_jwt_manager()
+        # Setup Flask-Jwt-Extended, which is only needed to authenticate requests to FAB REST APIs. It
+        # cannot be created lazily, as it registers error handlers that must be set before the first request.
+        if self.appbuilder.app.config.get("FAB_ADD_JWT_MANAGER", True):
+            self.create_jwt_manager()
 
     def register_views(self):
         """Register FAB auth manager related views."""
@@ -147,12 +189,9 @@ class FabAirflowSecurityManagerOverride(
             return
 
         if self.auth_user_registration:
-            if self.auth_type == AUTH_DB:
-                self.registeruser_view = self.registeruserdbview()
-            elif self.auth_type == AUTH_OID:
-                self.registeruser_view = self.registeruseroidview()
-            elif self.auth_type == AUTH_OAUTH:
-                self.registeruser_view = self.registeruseroauthview()
+            registeruser_view_name = self._REGISTER_USER_VIEW_BY_AUTH_TYPE.get(self.auth_type)
+            if registeruser_view_name:
+                self.registeruser_view = getattr(self, registeruser_view_name)()
             if self.registeruser_view:
                 self.appbuilder.add_view_no_menu(self.registeruser_view)
 
@@ -160,21 +199,9 @@ class FabAirflowSecurityManagerOverride(
         self.appbuilder.add_view_no_menu(self.resetmypasswordview())
         self.appbuilder.add_view_no_menu(self.userinfoeditview())
 
-        if self.auth_type == AUTH_DB:
-            self.user_view = self.userdbmodelview
-            self.auth_view = self.authdbview()
-        elif self.auth_type == AUTH_LDAP:
-            self.user_view = self.userldapmodelview
-            self.auth_view = self.authldapview()
-        elif self.auth_type == AUTH_OAUTH:
-            self.user_view = self.useroauthmodelview
-            self.auth_view = self.authoauthview()
-        elif self.auth_type == AUTH_REMOTE_USER:
-            self.user_view = self.userremoteusermodelview
-            self.auth_view = self.authremoteuserview()
-        else:
-            self.user_view = self.useroidmodelview
-            self.auth_view = self.authoidview()
+        # Unknown auth types fall back to OpenID views
+        self.user_view = getattr(self, self._USER_VIEW_BY_AUTH_TYPE.get(self.auth_type, "useroidmodelview"))
+        self.auth_view = getattr(self, self._AUTH_VIEW_BY_AUTH_TYPE.get(self.auth_type, "authoidview"))()
 
         self.appbuilder.add_view_no_menu(self.auth_view)
 
@@ -255,6 +282,8 @@ class FabAirflowSecurityManagerOverride(
 
     def create_jwt_manager(self):
         """Create the JWT manager."""
+        from flask_jwt_extended import JWTManager
+
         jwt_manager = JWTManager()
         jwt_manager.init_app(self.appbuilder.app)
         jwt_manager.user_lookup_loader(self.load_user_jwt)
@@ -268,51 +297,73 @@ class FabAirflowSecurityManagerOverride(
         :param password: the clear text password to reset and save hashed on the db
         """
         user = self.get_user_by_id(userid)
-        user.password = generate_password_hash(password)
+        user.password = self.hash_password(password)
         self.reset_user_sessions(user)
         self.update_user(user)
 
     def reset_user_sessions(self, user: User) -> None:
+        from itsdangerous import want_bytes
+
         if isinstance(self.appbuilder.get_app.session_interface, AirflowDatabaseSessionInterface):
             interface = self.appbuilder.get_app.session_interface
             session = interface.db.session
             user_session_model = interface.sql_session_model
-            num_sessions = session.query(user_session_model).count()
+            num_deleted = session.execute(
+                delete(user_session_model).where(user_session_model.user_id == user.id)
+            ).rowcount
+            # Commit right away so that the deleted rows are not kept locked while scanning the other sessions
+            session.commit()
+            # Sessions saved by webservers which do not fill the ``user_id`` column yet (for example during
+            # a rolling upgrade) can only be attributed to the user by deserializing their data. Sessions
+            # without a logged-in user have ``ANONYMOUS_USER_ID`` and are not part of them.
+            legacy_sessions = session.query(user_session_model).filter(user_session_model.user_id.is_(None))
+            # Only find out whether there are more sessions than the limit, which does not require counting
+            # all rows of a possibly huge table. The exact number is only needed for the warning.
+            num_sessions = legacy_sessions.limit(MAX_NUM_DATABASE_USER_SESSIONS + 1).count()
+            if num_sessions > MAX_NUM_DATABASE_USER_SESSIONS:
+                # Expired sessions cannot be used anymore, purge them and check again before giving up
+                session.execute(
+                    delete(user_session_model).where(
+                        user_session_model.user_id.is_(None), user_session_model.expiry < timezone.utcnow()
+                    )
+                )
+                session.commit()
+                num_sessions = legacy_sessions.limit(MAX_NUM_DATABASE_USER_SESSIONS + 1).count()
             if num_sessions > MAX_NUM_DATABASE_USER_SESSIONS:
+                num_sessions = legacy_sessions.count()
                 flash(
-                    Markup(
-                        f"The old sessions for user {user.username} have <b>NOT</b> been deleted!<br>"
-                        f"You have a lot ({num_sessions}) of user sessions in the 'SESSIONS' table in "
-                        f"your database.<br> "
-                        "This indicates that this deployment might have an automated API calls that create "
-                        "and not reuse sessions.<br>You should consider reusing sessions or cleaning them "
-                        "periodically using db clean.<br>"
-                        "Make sure to reset password for the user again after cleaning the session table "
-                        "to remove old sessions of the user."
-                    ),
+                    TOO_MANY_SESSIONS_WARNING.format(username=user.username, num_sessions=num_sessions),
                     "warning",
                 )
             else:
-                for s in session.query(user_session_model):
-                    session_details = interface.serializer.loads(want_bytes(s.data))
-                    if session_details.get("_user_id") == user.id:
-                        session.delete(s)
+                # Stream only the columns needed in batches, without building ORM objects, so that memory
+                # use does not grow with the size of the table.
+                # The serialized data of a session contains the ``_user_id`` key as a plain string only if
+                # a user is logged in with it. Looking for it in the raw data is much cheaper than
+                # deserializing, and skips the anonymous sessions that usually make up most of the table.
+                rows = legacy_sessions.with_entities(user_session_model.id, user_session_model.data)
+                # Bind the attributes used for every row to locals, as this loop can run many times.
+                # Flask-Session pickles the session data in the database, so this is ``pickle.loads``.
+                loads = interface.serializer.loads
+                user_id = user.id
+                ids_to_delete = []
+                for row_id, data in rows.yield_per(500):
+                    data = want_bytes(data)
+                    if b"_user_id" in data and loads(data).get("_user_id") == user_id:
+                        ids_to_delete.append(row_id)
+                # Delete all the matching sessions at once, in chunks to avoid very long IN clauses
+                for chunk in chunks(ids_to_delete, 1000):
+                    session.execute(delete(user_session_model).where(user_session_model.id.in_(chunk)))
+                num_deleted += len(ids_to_delete)
+                # The deletions run on the session of Flask-Session, which is not committed by update_user
+                session.commit()
+            log.debug("Deleted %s sessions of user %s", num_deleted, user.username)
         else:
-            flash(
-                Markup(
-                    "Since you are using `securecookie` session backend mechanism, we cannot prevent "
-                    f"some old sessions for user {user.username} to be reused.<br> If you want to make sure "
-                    "that the user is logged out from all sessions, you should consider using "
-                    "`database` session backend mechanism.<br> You can also change the 'secret_key` "
-                    "webserver configuration for all your webserver instances and restart the webserver. "
-                    "This however will logout all users from all sessions."
-                ),
-                "warning",
-            )
+            flash(SECURECOOKIE_SESSIONS_WARNING.format(username=user.username), "warning")
 
     def load_user(self, user_id):
         """Load user by ID."""
-        return self.get_user_by_id(int(user_id))
+        return self.get_cached_user_by_id(int(user_id))
 
     def load_user_jwt(self, _jwt_header, jwt_data):
         identity = jwt_data["sub"]
@@ -321,22 +372,32 @@ class FabAirflowSecurityManagerOverride(
         g.user = user
         return user
 
-    @property
+    @cached_property
     def auth_user_registration(self):
         """Will user self registration be allowed."""
         return self.appbuilder.app.config["AUTH_USER_REGISTRATION"]
 
-    @property
+    @cached_property
     def auth_type(self):
         """Get the auth type."""
         return self.appbuilder.app.config["AUTH_TYPE"]
 
-    @property
+    @cached_property
+    def auth_user_cache_ttl(self) -> int:
+        """Get the number of seconds loaded users are cached for."""
+        return self.appbuilder.app.config["AUTH_USER_CACHE_TTL"]
+
+    @cached_property
+    def password_hash_method(self) -> str | None:
+        """Get the method used to hash passwords, if not the default method of Werkzeug."""
+        return self.appbuilder.app.config.get("FAB_PASSWORD_HASH_METHOD")
+
+    @cached_property
     def is_auth_limited(self) -> bool:
         """Is the auth rate limited."""
         return self.appbuilder.app.config["AUTH_RATE_LIMITED"]
 
-    @property
+    @cached_property
     def auth_rate_limit(self) -> str:
         """Get the auth rate limit."""
         return self.appbuilder.app.config["AUTH_RATE_LIMIT"]
@@ -348,12 +409,12 @@ class FabAirflowSecurityManagerOverride(
 
         return ResourceModelView
 
-    @property
+    @cached_property
     def auth_role_public(self):
         """Gets the public role."""
         return self.appbuilder.app.config["AUTH_ROLE_PUBLIC"]
 
-    @property
+    @cached_property
     def oauth_providers(self):
         """Oauth providers."""
         return self.appbuilder.app.config["OAUTH_PROVIDERS"]
@@ -367,9 +428,12 @@ class FabAirflowSecurityManagerOverride(
         )
         return self.oauth_allow_list
 
-    def create_builtin_roles(self):
-        """Returns FAB builtin roles."""
-        return self.appbuilder.app.config.get("FAB_ROLES", {})
+    def create_builtin_roles(self) -> dict[str, frozenset[tuple[str, str]]]:
+        """Returns FAB builtin roles, with their (resource name, action name) pairs frozen."""
+        return {
+            role_name: frozenset(tuple(permission) for permission in permissions)
+            for role_name, permissions in self.appbuilder.app.config.get("FAB_ROLES", {}).items()
+        }
 
     def _init_config(self):
         """
@@ -377,48 +441,50 @@ class FabAirflowSecurityManagerOverride(
 
         :meta private:
         """
-        app = self.appbuilder.get_app
+        config = self.appbuilder.get_app.config
         # Base Security Config
-        app.config.setdefault("AUTH_ROLE_ADMIN", "Admin")
-        app.config.setdefault("AUTH_ROLE_PUBLIC", "Public")
-        app.config.setdefault("AUTH_TYPE", AUTH_DB)
+        config.setdefault("AUTH_ROLE_ADMIN", "Admin")
+        config.setdefault("AUTH_ROLE_PUBLIC", "Public")
+        config.setdefault("AUTH_TYPE", AUTH_DB)
         # Self Registration
-        app.config.setdefault("AUTH_USER_REGISTRATION", False)
-        app.config.setdefault("AUTH_USER_REGISTRATION_ROLE", self.auth_role_public)
-        app.config.setdefault("AUTH_USER_REGISTRATION_ROLE_JMESPATH", None)
+        config.setdefault("AUTH_USER_REGISTRATION", False)
+        config.setdefault("AUTH_USER_REGISTRATION_ROLE", self.auth_role_public)
+        config.setdefault("AUTH_USER_REGISTRATION_ROLE_JMESPATH", None)
         # Role Mapping
-        app.config.setdefault("AUTH_ROLES_MAPPING", {})
-        app.config.setdefault("AUTH_ROLES_SYNC_AT_LOGIN", False)
-        app.config.setdefault("AUTH_API_LOGIN_ALLOW_MULTIPLE_PROVIDERS", False)
+        config.setdefault("AUTH_ROLES_MAPPING", {})
+        config.setdefault("AUTH_ROLES_SYNC_AT_LOGIN", False)
+        config.setdefault("AUTH_API_LOGIN_ALLOW_MULTIPLE_PROVIDERS", False)
+        # User cache
+        config.setdefault("AUTH_USER_CACHE_TTL", 0)
 
         # LDAP Config
         if self.auth_type == AUTH_LDAP:
-            if "AUTH_LDAP_SERVER" not in app.config:
+            if "AUTH_LDAP_SERVER" not in config:
                 raise Exception("No AUTH_LDAP_SERVER defined on config with AUTH_LDAP authentication type.")
-            app.config.setdefault("AUTH_LDAP_SEARCH", "")
-            app.config.setdefault("AUTH_LDAP_SEARCH_FILTER", "")
-            app.config.setdefault("AUTH_LDAP_APPEND_DOMAIN", "")
-            app.config.setdefault("AUTH_LDAP_USERNAME_FORMAT", "")
-            app.config.setdefault("AUTH_LDAP_BIND_USER", "")
-            app.config.setdefault("AUTH_LDAP_BIND_PASSWORD", "")
+            config.setdefault("AUTH_LDAP_SEARCH", "")
+            config.setdefault("AUTH_LDAP_SEARCH_FILTER", "")
+            config.setdefault("AUTH_LDAP_APPEND_DOMAIN", "")
+            config.setdefault("AUTH_LDAP_USERNAME_FORMAT", "")
+            config.setdefault("AUTH_LDAP_BIND_USER", "")
+            config.setdefault("AUTH_LDAP_BIND_PASSWORD", "")
             # TLS options
-            app.config.setdefault("AUTH_LDAP_USE_TLS", False)
-            app.config.setdefault("AUTH_LDAP_ALLOW_SELF_SIGNED", False)
-            app.config.setdefault("AUTH_LDAP_TLS_DEMAND", False)
-            app.config.setdefault("AUTH_LDAP_TLS_CACERTDIR", "")
-            app.config.setdefault("AUTH_LDAP_TLS_CACERTFILE", "")
-            app.config.setdefault("AUTH_LDAP_TLS_CERTFILE", "")
-            app.config.setdefault("AUTH_LDAP_TLS_KEYFILE", "")
+            config.setdefault("AUTH_LDAP_USE_TLS", False)
+            config.setdefault("AUTH_LDAP_ALLOW_SELF_SIGNED", False)
+            config.setdefault("AUTH_LDAP_TLS_DEMAND", False)
+            config.setdefault("AUTH_LDAP_TLS_CACERTDIR", "")
+            config.setdefault("AUTH_LDAP_TLS_CACERTFILE", "")
+            config.setdefault("AUTH_LDAP_TLS_CERTFILE", "")
+            config.setdefault("AUTH_LDAP_TLS_KEYFILE", "")
             # Mapping options
-            app.config.setdefault("AUTH_LDAP_UID_FIELD", "uid")
-            app.config.setdefault("AUTH_LDAP_GROUP_FIELD", "memberOf")
-            app.config.setdefault("AUTH_LDAP_FIRSTNAME_FIELD", "givenName")
-            app.config.setdefault("AUTH_LDAP_LASTNAME_FIELD", "sn")
-            app.config.setdefault("AUTH_LDAP_EMAIL_FIELD", "mail")
+            config.setdefault("AUTH_LDAP_UID_FIELD", "uid")
+            config.setdefault("AUTH_LDAP_GROUP_FIELD", "memberOf")
+            config.setdefault("AUTH_LDAP_FIRSTNAME_FIELD", "givenName")
+            config.setdefault("AUTH_LDAP_LASTNAME_FIELD", "sn")
+            config.setdefault("AUTH_LDAP_EMAIL_FIELD", "mail")
 
         # Rate limiting
-        app.config.setdefault("AUTH_RATE_LIMITED", True)
-        app.config.setdefault("AUTH_RATE_LIMIT", "5 per 40 second")
+        config.setdefault("AUTH_RATE_LIMITED", True)
+        config.setdefault("AUTH_RATE_LIMIT", "5 per 40 second")
 
     def _init_auth(self):
         """
@@ -436,30 +502,26 @@ class FabAirflowSecurityManagerOverride(
 
             self.oauth = OAuth(app)
             self.oauth_remotes = {}
+            if not self.oauth_user_info:
+                self.oauth_user_info = self.get_oauth_user_info
+            # Whitelist only users with matching emails
+            self.oauth_allow_list = {
+                provider["name"]: provider["whitelist"]
+                for provider in self.oauth_providers
+                if "whitelist" in provider
+            }
             for provider in self.oauth_providers:
                 provider_name = provider["name"]
                 log.debug("OAuth providers init %s", provider_name)
                 obj_provider = self.oauth.register(provider_name, **provider["remote_app"])
                 obj_provider._tokengetter = FabAirflowSecurityManagerOverrideOauth.oauth_token_getter
-                if not self.oauth_user_info:
-                    self.oauth_user_info = self.get_oauth_user_info
-                # Whitelist only users with matching emails
-                if "whitelist" in provider:
-                    self.oauth_allow_list[provider_name] = provider["whitelist"]
                 self.oauth_remotes[provider_name] = obj_provider
 
     def _init_data_model(self):
         user_data_model = SQLAInterface(self.user_model)
-        if self.auth_type == const.AUTH_DB:
-            self.userdbmodelview.datamodel = user_data_model
-        elif self.auth_type == const.AUTH_LDAP:
-            self.userldapmodelview.datamodel = user_data_model
-        elif self.auth_type == const.AUTH_OID:
-            self.useroidmodelview.datamodel = user_data_model
-        elif self.auth_type == const.AUTH_OAUTH:
-            self.useroauthmodelview.datamodel = user_data_model
-        elif self.auth_type == const.AUTH_REMOTE_USER:
-            self.userremoteusermodelview.datamodel = user_data_model
+        user_view_name = self._USER_VIEW_BY_AUTH_TYPE.get(self.auth_type)
+        if user_view_name:
+            getattr(self, user_view_name).datamodel = user_data_model
 
         if self.userstatschartview:
             self.userstatschartview.datamodel = user_data_model
@@ -73,6 +73,14 @@ class MultiResourceUserMixin:
     def class_permission_name(self, name):
         self._class_permission_name = name
 
+    def post_update(self, item):
+        super().post_update(item)
+        self.appbuilder.sm.invalidate_user_cache(item.id)
+
+    def post_delete(self, item):
+        super().post_delete(item)
+        self.appbuilder.sm.invalidate_user_cache(item.id)
+
     @expose("/show/<pk>", methods=["GET"])
     @has_access
     def show(self, pk):
@@ -185,3 +193,7 @@ class CustomUserDBModelView(MultiResourceUserMixin, UserDBModelView):
         permissions.ACTION_CAN_EDIT,
         permissions.ACTION_CAN_DELETE,
     ]
+
+    def pre_add(self, item):
+        """Hash the password of the new user with the method configured in the security manager."""
+        item.password = self.appbuilder.sm.hash_password(item.password)
@@ -0,0 +1,95 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+"""Add ``user_id`` column to ``session`` table
+
+Revision ID: 1c3f0a9b8d2e
+Revises: 405de8318b3a
+Create Date: 2023-07-28 10:12:43.512208
+
+"""
+from __future__ import annotations
+
+import pickle
+from collections import defaultdict
+
+import sqlalchemy as sa
+from alembic import context, op
+
+# revision identifiers, used by Alembic.
+revision = "1c3f0a9b8d2e"
+down_revision = "405de8318b3a"
+branch_labels = None
+depends_on = None
+airflow_version = "2.7.0"
+
+TABLE_NAME = "session"
+INDEX_NAME = "idx_session_user_id"
+BATCH_SIZE = 1000
+# Value of ``user_id`` for sessions without a logged-in user, see airflow.www.session
+ANONYMOUS_USER_ID = 0
+
+
+def upgrade():
+    """Apply Add ``user_id`` column to ``session`` table"""
+    with op.batch_alter_table(TABLE_NAME) as batch_op:
+        batch_op.add_column(sa.Column("user_id", sa.Integer(), nullable=True))
+        batch_op.create_index(INDEX_NAME, ["user_id"])
+
+    # Backfill ``user_id`` of the existing sessions. This is the only time the session data of all rows
+    # is deserialized; afterwards the column is maintained by the session interface when saving sessions.
+    if not context.is_offline_mode():
+        _backfill_user_id(op.get_bind())
+
+
+def _backfill_user_id(conn):
+    session_table = sa.table(
+        TABLE_NAME,
+        sa.column("id", sa.Integer),
+        sa.column("data", sa.LargeBinary),
+        sa.column("user_id", sa.Integer),
+    )
+    last_id = None
+    while True:
+        # Page through the table by id so that only one batch of session data is in memory at a time,
+        # and no cursor is left open while updating.
+        query = sa.select(session_table.c.id, session_table.c.data).order_by(session_table.c.id)
+        if last_id is not None:
+            query = query.where(session_table.c.id > last_id)
+        rows = conn.execute(query.limit(BATCH_SIZE)).fetchall()
+        if not rows:
+            break
+        ids_by_user_id: dict[int, list[int]] = defaultdict(list)
+        for session_id, data in rows:
+            try:
+                user_id = pickle.loads(data).get("_user_id")
+            except Exception:
+                user_id = None
+            ids_by_user_id[ANONYMOUS_USER_ID if user_id is None else int(user_id)].append(session_id)
+        for user_id, session_ids in ids_by_user_id.items():
+            conn.execute(
+                session_table.update().where(session_table.c.id.in_(session_ids)).values(user_id=user_id)
+            )
+        last_id = rows[-1][0]
+
+
+def downgrade():
+    """Unapply Add ``user_id`` column to ``session`` table"""
+    with op.batch_alter_table(TABLE_NAME) as batch_op:
+        batch_op.drop_index(INDEX_NAME)
+        batch_op.drop_column("user_id")
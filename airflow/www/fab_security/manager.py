@@ -938,7 +938,7 @@ class BaseSecurityManager:
 
     def _has_access_builtin_roles(self, role, action_name: str, resource_name: str) -> bool:
         """Checks permission on builtin role."""
-        perms = self.builtin_roles.get(role.name, [])
+        perms = self.builtin_roles.get(role.name, frozenset())
         for _resource_name, _action_name in perms:
             if re2.match(_resource_name, resource_name) and re2.match(_action_name, action_name):
                 return True
@@ -817,3 +817,4 @@ class ApplessAirflowSecurityManager(AirflowSecurityManager):
 
     def __init__(self, session: Session | None = None):
         self.appbuilder = FakeAppBuilder(session)
+        self._user_cache = {}
@@ -19,6 +19,12 @@ from __future__ import annotations
 from flask import request
 from flask.sessions import SecureCookieSessionInterface
 from flask_session.sessions import SqlAlchemySessionInterface
+from itsdangerous import want_bytes
+from sqlalchemy import Column, Index, Integer, event
+
+# Value of ``user_id`` for sessions without a logged-in user, distinguishing them from sessions saved before
+# the column existed, whose ``user_id`` is NULL.
+ANONYMOUS_USER_ID = 0
 
 
 class SesssionExemptMixin:
@@ -34,7 +40,28 @@ class SesssionExemptMixin:
 
 
 class AirflowDatabaseSessionInterface(SesssionExemptMixin, SqlAlchemySessionInterface):
-    """Session interface that exempts some routes and stores session data in the database."""
+    """
+    Session interface that exempts some routes and stores session data in the database.
+
+    On top of the columns defined by Flask-Session, the session model gets an indexed ``user_id`` column
+    filled from the ``_user_id`` key of the session whenever a session is saved, or set to
+    ``ANONYMOUS_USER_ID`` if no user is logged in. This allows finding the sessions of a given user without
+    deserializing every row of the table; only sessions saved before the column existed have no ``user_id``.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Flask-Session creates the session model in its constructor, the column is added to it afterwards
+        session_model = self.sql_session_model
+        session_model.user_id = Column(Integer, nullable=True)
+        Index("idx_session_user_id", session_model.__table__.c.user_id)
+        event.listen(session_model, "before_insert", self._set_session_user_id)
+        event.listen(session_model, "before_update", self._set_session_user_id)
+
+    def _set_session_user_id(self, mapper, connection, target):
+        """Store the id of the user owning the session row being saved in its own column."""
+        data = self.serializer.loads(want_bytes(target.data))
+        target.user_id = data.get("_user_id", ANONYMOUS_USER_ID)
 
 
 class AirflowSecureCookieSessionInterface(SesssionExemptMixin, SecureCookieSessionInterface):